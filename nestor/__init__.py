@@ -1,12 +1,24 @@
 import logging.config
 import os
-import pathlib
 
-import yaml
+LOGGING_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'logging.yml')
 
-parent_directory = pathlib.Path(__file__).parent
+_configured = False
 
-with open(str(parent_directory) + os.sep + 'logging.yml') as f:
-    logging_config = yaml.safe_load(f)
 
-logging.config.dictConfig(logging_config)
+def configure() -> None:
+    """ Apply nestor's logging configuration; only the first call has an effect
+    Importing nestor does not configure logging, entry points must call this. The parsed logging.yml is cached
+    in a logging.yml.cache.json sidecar next to it, when the package directory is writable.
+    """
+    global _configured
+    if not _configured:
+        _configure_logging()
+        _configured = True
+
+
+def _configure_logging() -> None:
+    # imported here so that importing nestor does not pull in yaml
+    from nestor._yaml import load_cached
+
+    logging.config.dictConfig(load_cached(LOGGING_CONFIG_PATH))
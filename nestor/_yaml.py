@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Optional
+
+import yaml
+
+LOG = logging.getLogger('nestor')
+
+CACHE_SUFFIX = '.cache.json'
+
+# prefer the libyaml bindings when PyYAML was built with them
+SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# read once, the umask can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def safe_load(stream) -> Any:
+    return yaml.load(stream, Loader=SAFE_LOADER)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content).hexdigest()
+
+
+def load_cached(path: str, content: Optional[bytes] = None) -> Any:
+    """ Load a yaml file, re-using a json sidecar cache while the yaml content is unchanged
+    :param path: path of the yaml file to load
+    :param content: Optional content of the file when already read, it is then parsed instead of the file
+    :return: the parsed yaml document
+    """
+    if content is None:
+        with open(path, 'rb') as yaml_file:
+            content = yaml_file.read()
+    digest = content_hash(content)
+    cache_path = path + CACHE_SUFFIX
+    try:
+        with open(cache_path) as cache_file:
+            cached = json.load(cache_file)
+        if cached['hash'] == digest:
+            return cached['data']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    data = safe_load(content)
+    _write_cache(cache_path, digest, data)
+    return data
+
+
+def _write_cache(cache_path: str, digest: str, data: Any) -> None:
+    # the sidecar is an optimisation only, so any failure to write it is ignored
+    try:
+        serialized = json.dumps({'hash': digest, 'data': data})
+        if json.loads(serialized)['data'] != data:
+            # e.g. non-string mapping keys; a cached load must return exactly what a fresh parse does
+            LOG.debug('Yaml data of %s does not survive json, not caching it', cache_path)
+            return
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or None, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                temp_file.write(serialized)
+            # mkstemp creates the file as 0600, give it the mode a regular file would get
+            os.chmod(temp_path, 0o666 & ~_UMASK)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except (OSError, TypeError, ValueError):
+        LOG.debug('Could not write yaml cache %s', cache_path)
@@ -1,8 +1,11 @@
+import os
+from datetime import datetime
 from enum import Enum, unique
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
-import yaml
+from croniter import croniter
 
+from nestor._yaml import content_hash, load_cached
 from nestor.trello import Trello
 
 
@@ -16,10 +19,16 @@ class ActionType(Enum):
     ADD_CARD = 1
 
 
+REQUIRED_ADD_CARD_ARGS = frozenset(('board', 'list', 'name'))
+
+
 class AddCardExecution(object):
+    __slots__ = ('_arguments', '_trello')
+
     def __init__(self, trello: Trello, arguments: Dict[str, Any]):
-        if any(required_arg not in arguments for required_arg in ('board', 'list', 'name')):
-            raise ValueError('Required argument missing')
+        if not REQUIRED_ADD_CARD_ARGS.issubset(arguments):
+            missing_args = sorted(REQUIRED_ADD_CARD_ARGS.difference(arguments))
+            raise ValueError(f'Required argument missing: {missing_args}')
         self._arguments = arguments
         self._trello = trello
 
@@ -29,10 +38,14 @@ class AddCardExecution(object):
 
 
 class Trigger(object):
+    __slots__ = ('_type', '_cron_expr', '_cron_iter')
+
     def __init__(self, definition: Dict[str, Any]):
         if 'schedule' in definition:
             self._type = TriggerType.SCHEDULED
             self._cron_expr = definition['schedule']
+            # compiled once, the expression is not re-parsed for every execution lookup
+            self._cron_iter = croniter(self._cron_expr)
         else:
             raise ValueError('Unknown schedule definition')
 
@@ -47,18 +60,25 @@ class Trigger(object):
     def cron_expr(self):
         return self._cron_expr
 
+    def next_fire(self, after: datetime) -> datetime:
+        """ Get the first time the schedule fires strictly after the given time """
+        return self._cron_iter.get_next(ret_type=datetime, start_time=after)
+
 
 class Action(object):
+    __slots__ = ('_type', '_arguments', '_execute')
+
     def __init__(self, definition: Dict[str, Any], trello: Trello):
-        self._type = ActionType[definition['do'].upper()]
+        self._type, execution_factory = _ACTION_FACTORY[definition['do'].lower()]
         self._arguments: Dict[str, Any] = definition['with']
-        self._execution = ACTION_MAP[self._type](trello, self._arguments)
+        # keep the bound method, so executing does not go through the execution object each time
+        self._execute = execution_factory(trello, self._arguments).execute
 
     def __repr__(self):
         return f"Do {self._type} with arguments: {self._arguments}"
 
     def execute(self):
-        self._execution.execute()
+        self._execute()
 
     @property
     def type(self):
@@ -70,6 +90,8 @@ class Action(object):
 
 
 class Rule(object):
+    __slots__ = ('_trigger', '_actions')
+
     def __init__(self, trigger_def: Dict[str, Any], actions_def: List[Dict[str, Any]], trello: Trello):
         self._trigger = Trigger(trigger_def)
         self._actions = [Action(action_def, trello) for action_def in actions_def]
@@ -88,9 +110,19 @@ class Rule(object):
 
 class ConfiguredRules(object):
     def __init__(self, rule_file_path: str, trello: Trello):
-        with open(rule_file_path) as rule_file:
-            rule_defs = yaml.safe_load(rule_file)
-        self._rules = [Rule(rule_def['trigger'], rule_def['actions'], trello) for rule_def in rule_defs['rules']]
+        with open(rule_file_path, 'rb') as rule_file:
+            content = rule_file.read()
+        rules_hash = content_hash(content)
+        cache_key = os.path.abspath(rule_file_path)
+        cached = _RULES_CACHE.get(cache_key)
+        if cached and cached[0] == rules_hash and cached[1] is trello:
+            rules = cached[2]
+        else:
+            # built from the exact bytes that were hashed, so the cached rules always match their hash
+            rule_defs = load_cached(rule_file_path, content)
+            rules = [Rule(rule_def['trigger'], rule_def['actions'], trello) for rule_def in rule_defs['rules']]
+            _RULES_CACHE[cache_key] = (rules_hash, trello, rules)
+        self._rules = list(rules)
 
     @property
     def rules(self):
@@ -100,3 +132,12 @@ class ConfiguredRules(object):
 ACTION_MAP = {
     ActionType.ADD_CARD: AddCardExecution
 }
+
+# action names as written in rule files, resolved to their type & execution in a single lookup
+_ACTION_FACTORY = {
+    action_type.name.lower(): (action_type, execution) for action_type, execution in ACTION_MAP.items()
+}
+
+# latest rules built per rule file path, as (content hash, trello client, rules); only one entry is kept per file,
+# so replaced clients & outdated rules are released on the next load
+_RULES_CACHE: Dict[str, Tuple[str, Trello, List[Rule]]] = dict()
@@ -1,33 +1,36 @@
+import heapq
 import logging
-from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict, Tuple, Optional
-
-from croniter import croniter
+from typing import List, Tuple, Optional
 
 from nestor.rule_parser import Rule, TriggerType
 
 LOG = logging.getLogger('nestor')
 
 
-def parse_schedules(rules) -> Dict[croniter, Rule]:
-    return {
-        croniter(r.trigger.cron_expr, datetime.now()): r for r in rules if r.trigger.type == TriggerType.SCHEDULED
-    }
-
-
 class CronManager(object):
 
     def __init__(self, rules: List[Rule]):
-        self._rules = rules
+        self._rules = [r for r in rules if r.trigger.type == TriggerType.SCHEDULED]
+        # all schedules start from the same instant, so rules due together are executed together
+        now = datetime.now()
+        # heap of (next execution, rule index, rule); the index breaks ties between equal times
+        self._heap: List[Tuple[datetime, int, Rule]] = [
+            (rule.trigger.next_fire(now), index, rule) for index, rule in enumerate(self._rules)
+        ]
+        heapq.heapify(self._heap)
 
     def get_next_execution(self) -> Optional[Tuple[datetime, List[Rule]]]:
-        cron_to_rule = parse_schedules(self._rules)
-        if not cron_to_rule:
+        """ Pop the next execution time along with all rules due at it; those rules are re-scheduled
+        :return: the next execution time & the rules to execute then, or None if no rule is scheduled
+        """
+        if not self._heap:
             return None
-        next_executions = defaultdict(list)
-        for cron, rule in cron_to_rule.items():
-            next_executions[cron.get_next(ret_type=datetime)].append(rule)
-        next_execution_time, rules_to_execute = min(next_executions.items())
+        next_execution_time = self._heap[0][0]
+        rules_to_execute = list()
+        while self._heap and self._heap[0][0] == next_execution_time:
+            _, index, rule = self._heap[0]
+            rules_to_execute.append(rule)
+            heapq.heapreplace(self._heap, (rule.trigger.next_fire(next_execution_time), index, rule))
         LOG.info("Found next execution: Rules %s at %s", rules_to_execute, next_execution_time)
         return next_execution_time, rules_to_execute
@@ -1,7 +1,10 @@
+import nestor
 from nestor.rule_parser import ConfiguredRules
 from nestor.scheduling import CronManager
 from nestor.trello import Trello
 
+nestor.configure()
+
 t = Trello('key', 'token')
 
 rules = ConfiguredRules('test_schedule.yml', trello=t)
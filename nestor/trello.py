@@ -1,24 +1,36 @@
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, List, Dict, Tuple, NoReturn
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 LOG = logging.getLogger('nestor')
 
 CACHE_VALIDITY = 86400.0  # cache for a day
+MISSING_BOARD_VALIDITY = 300.0  # remember boards found missing for 5 minutes
 
+# retries only apply to idempotent methods, so card/list creation is never repeated
+HTTP_RETRIES = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
 
-@dataclass
+MAX_DISCOVERY_WORKERS = 16  # matches the session's connection pool size
+MAX_CHECKLIST_WORKERS = 8
+
+
+@dataclass(frozen=True)
 class TrelloList(object):
+    __slots__ = ('name', 'id')
     name: str
     id: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class TrelloLabel(object):
+    __slots__ = ('name', 'id', 'color')
     name: str
     id: str
     color: str
@@ -26,28 +38,49 @@ class TrelloLabel(object):
 
 @dataclass
 class TrelloBoard(object):
+    __slots__ = ('name', 'id', 'lists', 'labels')
     name: str
     id: str
-    lists: Optional[List[TrelloList]]
-    labels: Optional[List[TrelloLabel]]
+    lists: Optional[Dict[str, TrelloList]]
+    labels: Optional[Dict[str, TrelloLabel]]
 
 
 class RequiredResourceMissingException(Exception):
     pass
 
 
+def _index_by_name(items):
+    # on duplicate names the first item wins, as trello returns them in display order
+    index = dict()
+    for item in items:
+        index.setdefault(item.name, item)
+    return index
+
+
 class Trello(object):
     API_URL = 'https://api.trello.com'
+    CARDS_URL = API_URL + '/1/cards'
+    LISTS_URL = API_URL + '/1/lists'
+    CHECKLISTS_URL = API_URL + '/1/checklists'
+    MY_BOARDS_URL = API_URL + '/1/members/me/boards'
 
     def __init__(self, api_key: str, api_token: str):
         """ Initializer
         :param api_key: The trello api-key to use; see: https://trello.com/app-key
         :param api_token: The trello api-token to use; see: https://trello.com/app-key
         """
-        self._api_key = api_key
-        self._api_token = api_token
-        self._boards: List[TrelloBoard] = list()
+        self._auth_params: Dict[str, str] = {
+            'key': api_key,
+            'token': api_token
+        }
+        self._boards: Dict[str, TrelloBoard] = dict()
+        # names of boards found missing, with the time they were found missing
+        self._missing_boards: Dict[str, float] = dict()
         self._cache_time: float = 0.0
+        # a single pooled session keeps connections to the api alive across calls
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=HTTP_RETRIES))
+        self._session.params = self._auth_params
 
     def add_card(self, board_name: str, list_name: str, card_name: str, description: Optional[str] = None,
                  labels_names: Optional[List[str]] = None, due: Optional[datetime] = None,
@@ -73,41 +106,55 @@ class Trello(object):
         # create the card with due-date, description & position
         card_id = self._create_card(target_list, card_name, description, due, place_at_top)
         LOG.info('Base card created')
-        if labels_names:
-            # get the valid labels
-            labels_to_add = self._get_valid_label_ids(target_board, labels_names)
-            # add the valid labels
-            self._add_labels(card_id, labels_to_add)
-            LOG.info('Labels added to card')
-        if checklist:
-            # create the checklist
-            checklist_name, checklist_items = checklist[0], checklist[1]
-            self._create_checklist(card_id, checklist_name, checklist_items)
-            LOG.info('Checklist created & added to card')
+        # labels & checklist only depend on the card, so they are added concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pending = []
+            if labels_names:
+                # get the valid labels
+                labels_to_add = self._get_valid_label_ids(target_board, labels_names)
+                # add the valid labels
+                pending.append((executor.submit(self._add_labels, card_id, labels_to_add), 'Labels added to card'))
+            if checklist:
+                # create the checklist
+                checklist_name, checklist_items = checklist[0], checklist[1]
+                pending.append((executor.submit(self._create_checklist, card_id, checklist_name, checklist_items),
+                                'Checklist created & added to card'))
+            # wait for every step, so a failure in one does not hide the outcome of the other
+            errors = list()
+            for future, message in pending:
+                error = future.exception()
+                if error:
+                    LOG.error('Failed to complete card: %s', error)
+                    errors.append(error)
+                else:
+                    LOG.info(message)
+        if errors:
+            raise errors[0]
         LOG.info('Complete card created')
 
     def _get_board(self, board_name: str) -> Optional[TrelloBoard]:
-        cache_refreshed_already = False
-        # if the cache expired, refresh it
-        if not self.__cache_is_valid():
-            self._cache_all_boards()
-            cache_refreshed_already = True
-        # find in cache
-        cached_board = self.__get_cached_board(board_name)
-        if cached_board:
-            LOG.debug('Cached board was found')
-            return cached_board
-        # if not found in cache
-        if cache_refreshed_already:
-            # if cache was refreshed but board was still not found, then it's missing
-            LOG.error('Board was not found even after cache refresh')
-            return None
-        # if we hadn't refreshed the cached earlier, try refreshing again
+        # refresh the cache if it expired, or if the board may have been created since the last refresh
+        if self.__cache_is_valid():
+            if time.time() - self._missing_boards.get(board_name, 0.0) <= MISSING_BOARD_VALIDITY:
+                LOG.debug('Board %s was recently found to be missing', board_name)
+                return None
+            cached_board = self.__get_cached_board(board_name)
+            if cached_board:
+                return cached_board
         self._cache_all_boards()
-        return self.__get_cached_board(board_name)
+        cached_board = self.__get_cached_board(board_name)
+        if not cached_board:
+            # remember the miss for a short while, so repeated lookups of it do not each refresh the cache
+            LOG.error('Board %s was not found after cache refresh', board_name)
+            self._missing_boards[board_name] = time.time()
+        return cached_board
 
     def _get_list(self, board: TrelloBoard, list_name: str) -> TrelloList:
-        # board is assumed to be fresh (i.e. from a valid cache)
+        cached_list = self.__get_cached_list(board, list_name)
+        if cached_list:
+            return cached_list
+        # the list may have been created since the cache was refreshed, re-read the lists before creating a duplicate
+        board.lists = _index_by_name(self._discover_lists_in_board(board.id))
         cached_list = self.__get_cached_list(board, list_name)
         if cached_list:
             return cached_list
@@ -125,14 +172,14 @@ class Trello(object):
         if description:
             card_params['desc'] = description
         if due:
-            card_params['due'] = due.isoformat()[:-3] + 'Z'
+            # millisecond precision; isoformat() drops the fraction entirely when microsecond is 0
+            card_params['due'] = f'{due:%Y-%m-%dT%H:%M:%S}.{due.microsecond // 1000:03d}Z'
         if place_at_top:
             card_params['pos'] = 'top'
 
-        api_params = {**self.__auth_params(), **card_params}
-        api_url = Trello.API_URL + '/1/cards'
+        api_url = Trello.CARDS_URL
         LOG.debug('Making API call')
-        response = requests.post(api_url, params=api_params)
+        response = self._session.post(api_url, params=card_params)
         response.raise_for_status()
         return response.json()['id']
 
@@ -140,95 +187,112 @@ class Trello(object):
         LOG.debug('Creating list by name %s', list_name)
         api_params = {
             'name': list_name,
-            'idBoard': target_board.id,
-            **self.__auth_params()
+            'idBoard': target_board.id
         }
-        api_url = Trello.API_URL + '/1/lists'
-        response = requests.post(api_url, params=api_params)
+        api_url = Trello.LISTS_URL
+        response = self._session.post(api_url, params=api_params)
         response.raise_for_status()
         created_list = TrelloList(
             response.json()['name'],
             response.json()['id']
         )
-        target_board.lists.append(created_list)
+        target_board.lists[created_list.name] = created_list
         return created_list
 
     def _cache_all_boards(self) -> None:
         LOG.debug('Refreshing cache')
         boards = self._discover_all_boards()
-        for board in boards:
-            lists = self._discover_lists_in_board(board.id)
-            labels = self._discover_labels_in_board(board.id)
-            board.lists = lists
-            board.labels = labels
-        self._boards = boards
-
-    def _get_valid_label_ids(self, target_board: TrelloBoard, label_names: List[str]) -> List[str]:  # noqa
+        if boards:
+            # discover lists & labels of all boards concurrently, the session pool is shared by the workers
+            with ThreadPoolExecutor(max_workers=min(MAX_DISCOVERY_WORKERS, 2 * len(boards))) as executor:
+                lists_futures = [executor.submit(self._discover_lists_in_board, board.id) for board in boards]
+                labels_futures = [executor.submit(self._discover_labels_in_board, board.id) for board in boards]
+            for board, lists_future, labels_future in zip(boards, lists_futures, labels_futures):
+                board.lists = _index_by_name(lists_future.result())
+                board.labels = _index_by_name(labels_future.result())
+        self._boards = _index_by_name(boards)
+        self._missing_boards = dict()
+        self._cache_time = time.time()
+
+    def _get_valid_label_ids(self, target_board: TrelloBoard, label_names: List[str]) -> List[str]:
+        # labels are indexed by name when the cache is refreshed; repeated names are resolved once
+        label_names = dict.fromkeys(label_names)
+        if any(label_name not in target_board.labels for label_name in label_names):
+            # the labels may have been created since the cache was refreshed, re-read them once
+            target_board.labels = _index_by_name(self._discover_labels_in_board(target_board.id))
+        labels = target_board.labels
         return [
-            label.id for label in target_board.labels if label.name in label_names
+            labels[label_name].id for label_name in label_names if label_name in labels
         ]
 
     def _add_labels(self, card_id: str, label_ids: List[str]) -> NoReturn:
         LOG.debug('Adding %d labels to card', len(label_ids))
+        if not label_ids:
+            return
+        # the card was just created without labels, so all of them can be set in a single update
+        api_params = {
+            'idLabels': ','.join(label_ids)
+        }
+        api_url = f'{Trello.CARDS_URL}/{card_id}'
+        response = self._session.put(api_url, params=api_params)
+        if response.status_code != 400:
+            response.raise_for_status()
+            return
+        # a rejected label id fails the whole batch, so fall back to adding labels one by one
+        LOG.warning('Batch label update was rejected, adding labels individually')
+        api_url = f'{Trello.CARDS_URL}/{card_id}/idLabels'
         for label_id in label_ids:
             api_params = {
-                'value': label_id,
-                **self.__auth_params()
+                'value': label_id
             }
-            api_url = Trello.API_URL + f'/1/cards/{card_id}/idLabels'
-            response = requests.post(api_url, params=api_params)
+            response = self._session.post(api_url, params=api_params)
+            if response.status_code == 400:
+                # like unknown label names, labels that cannot be added are skipped
+                LOG.warning('Label %s was rejected, skipping it', label_id)
+                continue
             response.raise_for_status()
 
     def _create_checklist(self, card_id: str, checklist_name: str, items: List[str]) -> NoReturn:
         LOG.debug('Adding checklist %s with %d items to card', checklist_name, len(items))
         create_api_params = {
             'idCard': card_id,
-            'name': checklist_name,
-            **self.__auth_params()
+            'name': checklist_name
         }
-        create_api_url = Trello.API_URL + '/1/checklists'
-        response = requests.post(create_api_url, params=create_api_params)
+        create_api_url = Trello.CHECKLISTS_URL
+        response = self._session.post(create_api_url, params=create_api_params)
         response.raise_for_status()
         checklist_id = response.json()['id']
-        for item in items:
+        add_api_url = f'{Trello.CHECKLISTS_URL}/{checklist_id}/checkItems'
+
+        def add_item(position: int, item: str) -> None:
+            # items are created concurrently, so an explicit position keeps them in the configured order
             add_api_params = {
                 'name': item,
-                **self.__auth_params()
+                'pos': position
             }
-            add_api_url = Trello.API_URL + f'/1/checklists/{checklist_id}/checkItems'
-            response = requests.post(add_api_url, params=add_api_params)
-            response.raise_for_status()
+            add_response = self._session.post(add_api_url, params=add_api_params)
+            add_response.raise_for_status()
 
-    def __auth_params(self) -> Dict[str, str]:
-        return {
-            'key': self._api_key,
-            'token': self._api_token
-        }
+        if items:
+            with ThreadPoolExecutor(max_workers=min(MAX_CHECKLIST_WORKERS, len(items))) as executor:
+                # consume the results so that a failed item is raised here
+                list(executor.map(add_item, range(1, len(items) + 1), items))
 
     def __get_cached_board(self, board_name) -> Optional[TrelloBoard]:
-        searched_boards = [b for b in self._boards if b.name == board_name]
-        if not searched_boards:
-            return None
-        LOG.debug('Found %s boards by name %s', len(searched_boards), board_name)
-        return searched_boards[0]
+        return self._boards.get(board_name)
 
     def __get_cached_list(self, board: TrelloBoard, list_name) -> Optional[TrelloList]:  # noqa
-        searched_lists = [l for l in board.lists if l.name == list_name]
-        if not searched_lists:
-            return None
-        LOG.debug('Found %s lists by name %s in board %s', len(searched_lists), list_name, board.name)
-        return searched_lists[0]
+        return board.lists.get(list_name)
 
     def __cache_is_valid(self):
-        return self._boards and time.time() - self._cache_time <= CACHE_VALIDITY
+        return time.time() - self._cache_time <= CACHE_VALIDITY
 
     def _discover_all_boards(self) -> List[TrelloBoard]:
         api_params = {
-            'fields': 'name',
-            **self.__auth_params()
+            'fields': 'name'
         }
-        api_url = Trello.API_URL + '/1/members/me/boards'
-        response = requests.get(api_url, params=api_params)
+        api_url = Trello.MY_BOARDS_URL
+        response = self._session.get(api_url, params=api_params)
         response.raise_for_status()
         return [
             TrelloBoard(e['name'], e['id'], None, None) for e in response.json()
@@ -236,22 +300,18 @@ class Trello(object):
 
     def _discover_lists_in_board(self, board_id) -> List[TrelloList]:
         api_params = {
-            'fields': 'name',
-            **self.__auth_params()
+            'fields': 'name'
         }
         api_url = Trello.API_URL + f'/1/boards/{board_id}/lists'
-        response = requests.get(api_url, params=api_params)
+        response = self._session.get(api_url, params=api_params)
         response.raise_for_status()
         return [
             TrelloList(e['name'], e['id']) for e in response.json()
         ]
 
     def _discover_labels_in_board(self, board_id) -> List[TrelloLabel]:
-        api_params = {
-            **self.__auth_params()
-        }
         api_url = Trello.API_URL + f'/1/boards/{board_id}/labels'
-        response = requests.get(api_url, params=api_params)
+        response = self._session.get(api_url)
         response.raise_for_status()
         return [
             TrelloLabel(e['name'], e['id'], e['color']) for e in response.json()